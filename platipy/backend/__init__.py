@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 import os
 import uuid
@@ -31,12 +34,29 @@ if "WORK" in os.environ:
 log_file_path = os.path.join(env_work, "service.log")
 
 
+_log_listener = None
+
+
+def stop_logging():
+    """Stop the background log writer, flushing any queued records"""
+
+    global _log_listener
+
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
 def configure_logging():
+    global _log_listener
+
     logger = logging.getLogger()
 
     logger.handlers.clear()
     logger.setLevel(logging.DEBUG)
 
+    stop_logging()
+
     file_handler = logging.handlers.RotatingFileHandler(
         log_file_path,
         maxBytes=100 * 1024 * 1024,  # Max 100 MB per log file before rotating
@@ -45,13 +65,43 @@ def configure_logging():
     file_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     file_handler.setFormatter(file_formatter)
     file_handler.setLevel(logging.DEBUG)
-    logger.addHandler(file_handler)
 
     console_handler = logging.StreamHandler(sys.stdout)
     console_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     console_handler.setFormatter(console_formatter)
     console_handler.setLevel(logging.DEBUG)
-    logger.addHandler(console_handler)
+
+    # Log records are queued and written to the handlers by a background thread, so that logging
+    # calls in tasks and requests don't block on file and console I/O
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    _log_listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def log_directly_after_fork():
+    """
+    The log writer thread doesn't survive a fork, so records queued in the child process would
+    never be written. Write directly to the handlers until logging is configured again.
+    """
+
+    global _log_listener
+
+    if _log_listener is None:
+        return
+
+    logger = logging.getLogger()
+    logger.handlers.clear()
+    for handler in _log_listener.handlers:
+        logger.addHandler(handler)
+
+    _log_listener = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=log_directly_after_fork)
 
 
 @celery.signals.setup_logging.connect
@@ -59,6 +109,20 @@ def on_celery_setup_logging(**kwargs):
     configure_logging()
 
 
+@celery.signals.worker_process_init.connect
+def on_celery_worker_process_init(**kwargs):
+    # The log writer thread doesn't survive the fork into a worker process, so start a new one
+    configure_logging()
+
+
+@celery.signals.worker_process_shutdown.connect
+def on_celery_worker_process_shutdown(**kwargs):
+    # Worker processes exit without running atexit handlers, so flush queued records here
+    stop_logging()
+
+
+atexit.register(stop_logging)
+
 configure_logging()
 
 # Create Flask app
@@ -28,6 +28,8 @@ from flask import request, send_from_directory
 
 from functools import wraps
 
+from sqlalchemy.orm import selectinload
+
 from platipy.backend import app, api
 from platipy.dicom.communication import DicomConnector
 
@@ -38,7 +40,8 @@ logger = logging.getLogger(__name__)
 
 
 class CustomConfig(object):
-    RESTFUL_JSON = {"separators": (", ", ": "), "indent": 2, "cls": AlchemyEncoder}
+    # Compact JSON output, the client parses responses so pretty printing only costs time and bytes
+    RESTFUL_JSON = {"separators": (",", ":"), "cls": AlchemyEncoder}
 
 
 def authenticate(func):
@@ -64,36 +67,42 @@ class TaskStatus(Resource):
     def get(self, task_id):
         """Get the status of a task given the ID"""
         task = run_task.AsyncResult(task_id)
-        if task.state == "PENDING":
+
+        # Each access of state and info fetches the task meta from the result backend until the
+        # task is complete, so read them once
+        state = task.state
+        info = task.info
+
+        if state == "PENDING":
             response = {
-                "state": task.state,
+                "state": state,
                 "current": 0,
                 "total": 1,
                 "status": "Pending...",
             }
-        elif task.state != "FAILURE":
+        elif state != "FAILURE":
 
-            if task.info:
+            if info:
                 response = {
-                    "state": task.state,
-                    "current": task.info.get("current", 0),
-                    "total": task.info.get("total", 1),
-                    "status": task.info.get("status", ""),
+                    "state": state,
+                    "current": info.get("current", 0),
+                    "total": info.get("total", 1),
+                    "status": info.get("status", ""),
                 }
-                if "result" in task.info:
-                    response["result"] = task.info["result"]
-                if "series" in task.info:
-                    response["series"] = task.info["series"]
+                if "result" in info:
+                    response["result"] = info["result"]
+                if "series" in info:
+                    response["series"] = info["series"]
             else:
-                response = {"state": task.state}
+                response = {"state": state}
 
         else:
             # something went wrong in the background job
             response = {
-                "state": task.state,
+                "state": state,
                 "current": 1,
                 "total": 1,
-                "status": str(task.info),  # this is the exception raised
+                "status": str(info),  # this is the exception raised
             }
         return response
 
@@ -156,7 +165,13 @@ class DataObjectsEndpoint(Resource):
 
         key = request.headers["API_KEY"]
 
-        do = DataObject.query.filter(DataObject.dataset.has(owner_key=key)).all()
+        # Load the children of all data objects in one query, rather than lazily one query per
+        # data object as they are serialised
+        do = (
+            DataObject.query.options(selectinload(DataObject.children))
+            .filter(DataObject.dataset.has(owner_key=key))
+            .all()
+        )
 
         return do
 
@@ -421,7 +436,16 @@ class DatasetsEndpoint(Resource):
 
         key = request.headers["API_KEY"]
 
-        ds = Dataset.query.filter_by(owner_key=key).all()
+        # Load the data objects of all datasets in batched queries, rather than lazily a few
+        # queries per dataset as they are serialised
+        ds = (
+            Dataset.query.options(
+                selectinload(Dataset.input_data_objects).selectinload(DataObject.children),
+                selectinload(Dataset.output_data_objects).selectinload(DataObject.children),
+            )
+            .filter_by(owner_key=key)
+            .all()
+        )
 
         return ds
 
@@ -104,14 +104,18 @@ class FlaskApp(Flask):
         def series_recieved(dicom_path):
             logger.info("Series Recieved at path: %s", dicom_path)
 
-            # Get the SeriesUID
+            # Get the SeriesUID, all files received are from the same series so stop at the first
+            # one found and only read that tag from the file
             series_uid = None
             for f in os.listdir(dicom_path):
                 f = os.path.join(dicom_path, f)
 
                 try:
-                    d = pydicom.read_file(f)
+                    d = pydicom.read_file(
+                        f, stop_before_pixels=True, specific_tags=["SeriesInstanceUID"]
+                    )
                     series_uid = d.SeriesInstanceUID
+                    break
                 except Exception as e:
                     logger.debug("No Series UID in: %s", f)
                     logger.debug(e)
@@ -133,7 +137,8 @@ class FlaskApp(Flask):
 
                 do.is_fetched = True
                 do.path = str(dicom_path)
-                db.session.commit()
+
+            db.session.commit()
 
         try:
             dicom_listener = DicomListener(
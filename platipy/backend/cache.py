@@ -0,0 +1,167 @@
+# Copyright 2020 University of New South Wales, University of Sydney, Ingham Institute
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import hashlib
+import os
+import tempfile
+import time
+
+from pathlib import Path
+
+import logging
+import SimpleITK as sitk
+
+from platipy.backend import env_work
+
+logger = logging.getLogger(__name__)
+
+# DICOM series converted to NIfTI by the services are kept between runs, up to this many images of
+# each kind and this many bytes in total (set NIFTI_CACHE_MAX_BYTES to 0 to disable the cache).
+# Images not used within the default Dataset timeout are removed by the clean up task.
+CONVERSION_CACHE_DIR = Path(env_work).joinpath("nifti_cache")
+CONVERSION_CACHE_SIZE = 16
+CONVERSION_CACHE_MAX_AGE = datetime.timedelta(hours=24)
+
+CONVERSION_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+if "NIFTI_CACHE_MAX_BYTES" in os.environ:
+    CONVERSION_CACHE_MAX_BYTES = int(os.environ["NIFTI_CACHE_MAX_BYTES"])
+
+# Size of the blocks in which series files are read when hashing them
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# Images are written here and moved into place once complete, so partly written files are never
+# seen by readers or by the eviction of cached images
+_CACHE_TMP_DIR = CONVERSION_CACHE_DIR.joinpath("tmp")
+
+
+def series_cache_key(series_path):
+    """
+    Generate a key for the DICOM series in the directory series_path by hashing the names and
+    contents of its files. Only identical files give the same key, so a cached image is never
+    used for a series which differs from the one it was converted from.
+
+    Returns None if the cache is disabled or the directory has no files, the series can't be
+    cached then.
+    """
+
+    if CONVERSION_CACHE_MAX_BYTES <= 0:
+        return None
+
+    series_path = Path(series_path)
+    files = sorted(f for f in series_path.iterdir() if f.is_file())
+
+    if not files:
+        return None
+
+    key = hashlib.blake2b(digest_size=16)
+    for file_path in files:
+        key.update(f"{file_path.relative_to(series_path)}\n".encode())
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+                key.update(block)
+
+    return key.hexdigest()
+
+
+def cache_path(cache_key, kind="image"):
+    """
+    Get the path in the cache for the image of the given kind with cache_key
+    """
+
+    cache_dir = CONVERSION_CACHE_DIR.joinpath(kind)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir.joinpath(f"{cache_key}.nii")
+
+
+def use_cached(path):
+    """
+    Mark the image at path in the cache as used. Returns False if it isn't in the cache.
+    """
+
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+
+    logger.info("Using cached image: %s", path)
+    return True
+
+
+def read_series(series_path):
+    """
+    Read the DICOM series in the directory series_path, splitting the work across all cores.
+    """
+
+    reader = sitk.ImageSeriesReader()
+    reader.SetFileNames(reader.GetGDCMSeriesFileNames(str(series_path)))
+    reader.SetNumberOfWorkUnits(os.cpu_count() or 1)
+    return reader.Execute()
+
+
+def _cached_files(cache_dir, pattern="*.nii"):
+    """
+    List the files in cache_dir with their modification times and sizes, skipping any removed by
+    another writer in the meantime
+    """
+
+    cached_files = []
+    for cached_file in cache_dir.glob(pattern):
+        try:
+            file_stat = cached_file.stat()
+        except FileNotFoundError:
+            continue
+        cached_files.append((file_stat.st_mtime, file_stat.st_size, cached_file))
+
+    return cached_files
+
+
+def add_to_cache(img, path):
+    """
+    Write img to path in the cache, then evict the least recently used images of the same kind
+    if there are too many, and the least recently used images of any kind if the cache is larger
+    than CONVERSION_CACHE_MAX_BYTES.
+    """
+
+    _CACHE_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".nii", dir=_CACHE_TMP_DIR)
+    os.close(fd)
+    try:
+        sitk.WriteImage(img, tmp_path, useCompression=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    cached_files = sorted(_cached_files(path.parent), reverse=True)
+    for _, _, cached_file in cached_files[CONVERSION_CACHE_SIZE:]:
+        cached_file.unlink(missing_ok=True)
+
+    cache_bytes = 0
+    cached_files = sorted(_cached_files(CONVERSION_CACHE_DIR, "*/*.nii"), reverse=True)
+    for _, size, cached_file in cached_files:
+        cache_bytes += size
+        if cache_bytes > CONVERSION_CACHE_MAX_BYTES:
+            cached_file.unlink(missing_ok=True)
+
+
+def purge_cache(max_age=CONVERSION_CACHE_MAX_AGE):
+    """
+    Remove images, including any left partly written, which haven't been used within max_age
+    """
+
+    expiry = time.time() - max_age.total_seconds()
+    for mtime, _, cached_file in _cached_files(CONVERSION_CACHE_DIR, "*/*.nii"):
+        if mtime < expiry:
+            cached_file.unlink(missing_ok=True)
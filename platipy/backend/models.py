@@ -19,6 +19,10 @@ import json
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
+# Values of these types can always be encoded as JSON as is
+JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
 # This custom encoder takes care of converting our SQLAlchemy models to a JSON
 # encodable format.
 class AlchemyEncoder(json.JSONEncoder):
@@ -32,6 +36,11 @@ class AlchemyEncoder(json.JSONEncoder):
             ]:
                 data = obj.__getattribute__(field)
 
+                # Most fields are plain values, only probe other types by encoding them
+                if isinstance(data, JSON_SCALAR_TYPES):
+                    fields[field] = data
+                    continue
+
                 try:
                     # this will fail on non-encodable values, like other classes
                     json.dumps(data)
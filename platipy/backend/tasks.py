@@ -16,12 +16,15 @@ import tempfile
 import os
 import datetime
 import shutil
+import stat
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from celery.schedules import crontab
 
 from platipy.backend import celery, db, app
+from platipy.backend.cache import purge_cache
 from platipy.dicom.communication import DicomConnector
 
 from .models import Dataset, DataObject
@@ -39,6 +42,64 @@ celery.conf.beat_schedule = {
 
 celery.conf.timezone = "UTC"
 
+# Expired directories are removed in parallel so that the clean up task isn't held up by deleting
+# many small DICOM files one directory at a time
+_cleanup_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rmtree")
+
+
+def remove_directory(path):
+    """
+    Remove the directory at path, logging rather than raising any error. Returns True if the
+    directory was removed
+    """
+
+    try:
+        shutil.rmtree(path)
+    except OSError as e:
+        logger.warning("Unable to remove directory: %s", path)
+        logger.warning(e)
+        return False
+
+    return True
+
+
+# Maximum number of output objects sent to a Dicom location at the same time
+SEND_WORKERS = 4
+
+# Successful Dicom location verifications are reused for this many seconds
+VERIFY_CACHE_TIMEOUT = 30
+_verify_cache = {}
+
+
+def cached_verify(dicom_connector):
+    """
+    Verify the Dicom location of the connector, reusing a recent successful verification of the
+    same location (host, port and AE title) to avoid a C-ECHO round trip for every task
+    """
+
+    key = (dicom_connector.host, dicom_connector.port, dicom_connector.ae_title)
+    now = time.monotonic()
+
+    verified_at = _verify_cache.get(key)
+    if verified_at is not None and now - verified_at < VERIFY_CACHE_TIMEOUT:
+        return True
+
+    result = dicom_connector.verify()
+    if result:
+        _verify_cache[key] = now
+    else:
+        _verify_cache.pop(key, None)
+
+    return result
+
+
+def invalidate_verify(dicom_connector):
+    """
+    Forget any cached verification of the Dicom location of the connector
+    """
+
+    _verify_cache.pop((dicom_connector.host, dicom_connector.port, dicom_connector.ae_title), None)
+
 
 @celery.task(bind=True)
 def run_dicom_listener(task):
@@ -58,6 +119,7 @@ def clean_up_task(task):
     now = datetime.datetime.now()
 
     num_data_objs_removed = 0
+    removals = []
 
     for ds in datasets:
 
@@ -69,10 +131,17 @@ def clean_up_task(task):
 
                 try:
                     if do.path:
-                        if os.path.isdir(do.path):
+                        # A single stat tells us whether the path is missing, a directory or a file
+                        try:
+                            path_mode = os.stat(do.path).st_mode
+                        except FileNotFoundError:
+                            path_mode = None
+
+                        if path_mode is not None and stat.S_ISDIR(path_mode):
                             logger.debug("Removing Directory: %s", do.path)
-                            shutil.rmtree(do.path)
-                        elif os.path.isfile(do.path):
+                            removals.append((do, _cleanup_pool.submit(remove_directory, do.path)))
+                            continue
+                        elif path_mode is not None and stat.S_ISREG(path_mode):
                             logger.debug("Removing File: %s", do.path)
                             os.remove(do.path)
                         else:
@@ -85,11 +154,26 @@ def clean_up_task(task):
 
                         do.is_fetched = False
                         do.path = None
-                        db.session.commit()
 
                 except Exception as e:
                     logger.warning("Exception occured when removing DataObject: %s", do)
 
+    # Remove converted images which are no longer used, such as those of expired Datasets
+    purge_cache()
+
+    # Wait for the directories to be removed before recording them as removed, Celery worker
+    # processes exit without running atexit handlers so they can't be left pending. Directories
+    # which couldn't be removed keep their path so the next clean up tries again
+    for do, removal in removals:
+        if removal.result():
+            num_data_objs_removed += 1
+
+            do.is_fetched = False
+            do.path = None
+
+    # Commit all the updated DataObjects at once rather than one write per object
+    db.session.commit()
+
     logger.info("Clean Up Task Complete: Removed %s DataObjects", num_data_objs_removed)
 
 
@@ -106,7 +190,7 @@ def retrieve_task(task, data_object_id):
         port=do.dataset.from_dicom_location.port,
         ae_title=do.dataset.from_dicom_location.ae_title,
     )
-    dicom_verify = dicom_connector.verify()
+    dicom_verify = cached_verify(dicom_connector)
 
     if not dicom_verify:
         logger.error(
@@ -214,40 +298,53 @@ def run_task(task, algorithm_name, config, dataset_id):
     # Save the data objects
     for do in output_data_objects:
         do.dataset_id = ds.id
-        db.session.add(do)
-        db.session.commit()
-
-        if do.type == "DICOM":
-            if ds.to_dicom_location:
-
-                logger.info("Sending to Dicom To Location")
-                dicom_connector = DicomConnector(
-                    host=do.dataset.to_dicom_location.host,
-                    port=do.dataset.to_dicom_location.port,
-                    ae_title=do.dataset.to_dicom_location.ae_title,
-                )
-                dicom_verify = dicom_connector.verify()
-
-                if not dicom_verify:
-                    logger.error(
-                        "Unable to connect to Dicom Location: %s %s %s",
-                        do.dataset.to_dicom_location.host,
-                        do.dataset.to_dicom_location.port,
-                        do.dataset.to_dicom_location.ae_title,
-                    )
-                    continue
+    db.session.add_all(output_data_objects)
+    db.session.commit()
 
-                send_result = dicom_connector.send_dcm(do.path)
+    # All outputs are sent to the Dataset's Dicom To location, so one connector serves every send
+    dicom_connector = None
+    if ds.to_dicom_location:
+        dicom_connector = DicomConnector(
+            host=ds.to_dicom_location.host,
+            port=ds.to_dicom_location.port,
+            ae_title=ds.to_dicom_location.ae_title,
+        )
 
-                if send_result:
-                    do.is_sent = True
-                    db.session.add(do)
-                    db.session.commit()
+    # Send the DICOM outputs concurrently, network transfers of each object can overlap. The
+    # database is only touched from this thread.
+    sends = []
+    with ThreadPoolExecutor(max_workers=SEND_WORKERS) as executor:
+        for do in output_data_objects:
+            if do.type == "DICOM":
+                if dicom_connector:
+
+                    logger.info("Sending to Dicom To Location")
+                    dicom_verify = cached_verify(dicom_connector)
+
+                    if not dicom_verify:
+                        logger.error(
+                            "Unable to connect to Dicom Location: %s %s %s",
+                            dicom_connector.host,
+                            dicom_connector.port,
+                            dicom_connector.ae_title,
+                        )
+                        continue
+
+                    sends.append((do, executor.submit(dicom_connector.send_dcm, do.path)))
+
+                else:
+                    logger.warning(
+                        "DICOM Data Object output but not Dicom To location defined in Dataset"
+                    )
 
+        for do, send in sends:
+            if send.result():
+                do.is_sent = True
             else:
-                logger.warning(
-                    "DICOM Data Object output but not Dicom To location defined in Dataset"
-                )
+                invalidate_verify(dicom_connector)
+
+    # Commit the sent status of all data objects in one go
+    db.session.commit()
 
     end = time.time()
     time_taken = end - start
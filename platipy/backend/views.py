@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import time
 import logging
 logger = logging.getLogger(__name__)
 import psutil
@@ -23,6 +25,33 @@ from platipy.dicom.communication import DicomConnector
 from .models import db, APIKey
 
 
+# Seconds for which the Celery worker status is reused between status requests
+CELERY_STATUS_TIMEOUT = 5
+_celery_status = {"running": False, "checked": None}
+
+
+def celery_running():
+    """
+    Check if any Celery worker is running. Workers are pinged at most once every
+    CELERY_STATUS_TIMEOUT seconds, otherwise the last result is returned.
+    """
+
+    now = time.monotonic()
+    checked = _celery_status["checked"]
+    if checked is None or now - checked > CELERY_STATUS_TIMEOUT:
+        _celery_status["running"] = bool(celery.control.ping(timeout=0.2))
+        _celery_status["checked"] = now
+
+    return _celery_status["running"]
+
+
+@app.template_filter("format_settings")
+def format_settings(settings):
+    """Format algorithm settings as indented JSON for display in templates"""
+
+    return json.dumps(settings, indent=4)
+
+
 @app.route("/endpoint/add", methods=["GET"])
 def add_endpoint():
 
@@ -32,11 +61,8 @@ def add_endpoint():
 @app.route("/log", methods=["GET"])
 def fetch_log():
 
-    log = []
     with open(log_file_path) as f:
-
-        for line in f:
-            log.append(line.replace("\n", ""))
+        log = f.read().splitlines()
 
     return jsonify({"log": log})
 
@@ -63,17 +89,13 @@ def view_endpoint(id):
         data=app.data,
         endpoint=endpoint,
         status=status,
-        format_settings=lambda x: json.dumps(x, indent=4),
     )
 
 
 @app.route("/status", methods=["GET"])
 def fetch_status():
 
-    celery_running = False
-    if celery.control.inspect().active():
-        celery_running = True
-    status_context = {"celery": celery_running}
+    status_context = {"celery": celery_running()}
     status_context["algorithms"] = []
     for a in app.algorithms:
         algorithm = app.algorithms[a]
@@ -29,7 +29,7 @@ def compute_volume(label):
         float: The volume (in cubic centimetres)
     """
 
-    return sitk.GetArrayFromImage(label).sum() * np.prod(label.GetSpacing()) / 1000
+    return sitk.GetArrayViewFromImage(label).sum() * np.prod(label.GetSpacing()) / 1000
 
 
 def compute_surface_dsc(label_a, label_b, tau=3.0):
@@ -65,8 +65,8 @@ def compute_surface_dsc(label_a, label_b, tau=3.0):
     a_intersection = sitk.GetArrayFromImage(a_contour * (dist_to_b <= tau)).sum()
 
     surface_sum = (
-        sitk.GetArrayFromImage(a_contour).sum()
-        + sitk.GetArrayFromImage(b_contour).sum()
+        sitk.GetArrayViewFromImage(a_contour).sum()
+        + sitk.GetArrayViewFromImage(b_contour).sum()
     )
 
     return (b_intersection + a_intersection) / surface_sum
@@ -287,8 +287,8 @@ def compute_metric_masd(label_a, label_b, auto_crop=True):
         label_b = crop_to_roi(label_b, size=crop_box_size, index=crop_box_index)
 
     if (
-        sitk.GetArrayViewFromImage(label_a).sum() == 0
-        or sitk.GetArrayViewFromImage(label_b).sum() == 0
+        not sitk.GetArrayViewFromImage(label_a).any()
+        or not sitk.GetArrayViewFromImage(label_b).any()
     ):
         return np.nan
 
@@ -331,8 +331,8 @@ def compute_metric_hd(label_a, label_b, auto_crop=True):
         label_b = crop_to_roi(label_b, size=crop_box_size, index=crop_box_index)
 
     if (
-        sitk.GetArrayViewFromImage(label_a).sum() == 0
-        or sitk.GetArrayViewFromImage(label_b).sum() == 0
+        not sitk.GetArrayViewFromImage(label_a).any()
+        or not sitk.GetArrayViewFromImage(label_b).any()
     ):
         return np.nan
 
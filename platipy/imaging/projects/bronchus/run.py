@@ -30,13 +30,15 @@ BRONCHUS_SETTINGS_DEFAULTS = {
 }
 
 
-def run_bronchus_segmentation(input_image, settings=BRONCHUS_SETTINGS_DEFAULTS):
+def run_bronchus_segmentation(input_image, settings=BRONCHUS_SETTINGS_DEFAULTS, lung_mask=None):
     """Runs the Proximal Bronchial Tree segmentation
 
     Args:
         input_image (sitk.Image): SimpleITK image on which to perform the segmentation
         settings (dict, optional): Dictionary containing settings for algorithm.
                                    Defaults to BRONCHUS_SETTINGS_DEFAULTS.
+        lung_mask (sitk.Image, optional): Lung mask previously generated for input_image. If
+                                          None, the lung mask is generated. Defaults to None.
 
     Returns:
         dict: Dictionary containing output of segmentation
@@ -45,8 +47,9 @@ def run_bronchus_segmentation(input_image, settings=BRONCHUS_SETTINGS_DEFAULTS):
     working_directory = tempfile.mkdtemp()
     results = {}
 
-    # Compute the lung mask
-    lung_mask = generate_lung_mask(input_image)
+    # Compute the lung mask, unless it was already generated for this image
+    if lung_mask is None:
+        lung_mask = generate_lung_mask(input_image)
     results[settings["outputLungName"]] = lung_mask
 
     bronchus_mask = generate_airway_mask(
@@ -0,0 +1,165 @@
+# Copyright 2021 University of New South Wales, University of Sydney, Ingham Institute
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=redefined-outer-name,missing-function-docstring
+
+import os
+import shutil
+
+import pytest
+
+import SimpleITK as sitk
+
+import platipy.imaging.utils.io
+from platipy.imaging.utils.io import compress_file, find_empty_masks, link_file
+
+
+def write_mask(path, voxels=()):
+    mask = sitk.Image(20, 20, 10, sitk.sitkUInt8)
+    for voxel in voxels:
+        mask[voxel] = 1
+
+    sitk.WriteImage(mask, str(path))
+    return path
+
+
+@pytest.fixture
+def count_decodes(monkeypatch):
+
+    decoded = []
+    mask_is_empty = platipy.imaging.utils.io.mask_is_empty
+
+    def counting_mask_is_empty(mask_path):
+        decoded.append(mask_path)
+        return mask_is_empty(mask_path)
+
+    monkeypatch.setattr(platipy.imaging.utils.io, "mask_is_empty", counting_mask_is_empty)
+
+    return decoded
+
+
+def test_find_empty_masks(tmp_path):
+
+    empty = [write_mask(tmp_path.joinpath(f"empty_{i}.nii.gz")) for i in range(3)]
+    non_empty = [
+        write_mask(tmp_path.joinpath("one_voxel.nii.gz"), [(5, 5, 5)]),
+        write_mask(tmp_path.joinpath("two_voxels.nii.gz"), [(1, 2, 3), (10, 10, 8)]),
+    ]
+
+    assert find_empty_masks(empty + non_empty) == set(empty)
+    assert find_empty_masks(non_empty) == set()
+    assert find_empty_masks([]) == set()
+
+
+def test_find_empty_masks_identical_not_decoded(tmp_path, count_decodes):
+
+    empty = [write_mask(tmp_path.joinpath(f"empty_{i}.nii.gz")) for i in range(5)]
+
+    assert find_empty_masks(empty) == set(empty)
+
+    # Only the first empty mask is decoded, the rest are compared on disk
+    assert len(count_decodes) == 1
+
+
+def test_find_empty_masks_same_size_group(tmp_path, count_decodes):
+
+    # Uncompressed masks of the same dimensions all have the same file size, so they are grouped
+    # together whether empty or not
+    empty = [write_mask(tmp_path.joinpath(f"empty_{i}.nii")) for i in range(2)]
+    non_empty = [
+        write_mask(tmp_path.joinpath("non_empty_0.nii"), [(5, 5, 5)]),
+        write_mask(tmp_path.joinpath("non_empty_1.nii"), [(6, 6, 6)]),
+    ]
+    mask_paths = [non_empty[0], empty[0], non_empty[1], empty[1]]
+
+    assert len({p.stat().st_size for p in mask_paths}) == 1
+    assert find_empty_masks(mask_paths) == set(empty)
+
+    # Masks differing from the empty reference are decoded, the identical one is not
+    assert set(count_decodes) == {non_empty[0], empty[0], non_empty[1]}
+
+
+@pytest.fixture
+def source_file(tmp_path):
+
+    source_path = tmp_path.joinpath("source.nii")
+    source_path.write_bytes(b"image data")
+    return source_path
+
+
+def test_link_file_hard_link(tmp_path, source_file):
+
+    target_path = tmp_path.joinpath("target.nii")
+    link_file(source_file, target_path)
+
+    assert not target_path.is_symlink()
+    assert os.path.samefile(source_file, target_path)
+    assert source_file.stat().st_nlink == 2
+
+
+def test_link_file_symlink_fallback(tmp_path, source_file, monkeypatch):
+
+    def fail_link(*args):
+        raise OSError("Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", fail_link)
+
+    target_path = tmp_path.joinpath("target.nii")
+    link_file(source_file, target_path)
+
+    assert target_path.is_symlink()
+    assert os.readlink(target_path) == str(source_file.resolve())
+    assert target_path.read_bytes() == b"image data"
+
+
+def test_link_file_copy_fallback(tmp_path, source_file, monkeypatch):
+
+    def fail_link(*args):
+        raise OSError("Operation not permitted")
+
+    monkeypatch.setattr(os, "link", fail_link)
+    monkeypatch.setattr(os, "symlink", fail_link)
+
+    target_path = tmp_path.joinpath("target.nii")
+    link_file(source_file, target_path)
+
+    assert not target_path.is_symlink()
+    assert not os.path.samefile(source_file, target_path)
+    assert target_path.read_bytes() == b"image data"
+
+
+def check_compressed(mask_path, compressed_path):
+
+    assert compressed_path == f"{mask_path}.gz"
+    assert not mask_path.exists()
+
+    arr = sitk.GetArrayFromImage(sitk.ReadImage(compressed_path))
+    assert arr.sum() == 1
+    assert arr[5, 5, 5] == 1
+
+
+def test_compress_file(tmp_path, monkeypatch):
+
+    # Use the Python gzip fallback whether or not pigz is installed
+    monkeypatch.setattr(shutil, "which", lambda cmd: None)
+
+    mask_path = write_mask(tmp_path.joinpath("mask.nii"), [(5, 5, 5)])
+    check_compressed(mask_path, compress_file(mask_path))
+
+
+@pytest.mark.skipif(shutil.which("pigz") is None, reason="pigz is not installed")
+def test_compress_file_pigz(tmp_path):
+
+    mask_path = write_mask(tmp_path.joinpath("mask.nii"), [(5, 5, 5)])
+    check_compressed(mask_path, compress_file(mask_path))
@@ -1,3 +1,12 @@
+import filecmp
+import gzip
+import os
+import shutil
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 from matplotlib import cm
 import numpy as np
 import SimpleITK as sitk
@@ -125,3 +134,108 @@ def write_nrrd_structure_set(
         useCompression=use_compression,
         compressionLevel=compression_level,
     )
+
+
+def link_file(source_path, target_path):
+    """Make the file at source_path available at target_path without copying it where possible.
+    A hard link is used, falling back to a symbolic link (such as across file systems) and then
+    to a copy if no link can be created.
+
+    Args:
+        source_path (str|pathlib.Path): The file to link to
+        target_path (str|pathlib.Path): The path to make the file available at
+    """
+
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        try:
+            os.symlink(Path(source_path).resolve(), target_path)
+        except OSError:
+            shutil.copyfile(source_path, target_path)
+
+
+def compress_file(file_path, compression_level=6):
+    """Gzip the file at file_path, replacing it with the compressed file. pigz is used if it is
+    installed since it compresses using multiple threads.
+
+    Args:
+        file_path (str|pathlib.Path): The file to compress
+        compression_level (int, optional): The gzip compression level, between 1-9. Defaults to
+            6.
+
+    Returns:
+        str: The path of the compressed file
+    """
+
+    file_path = str(file_path)
+
+    if shutil.which("pigz"):
+        subprocess.run(["pigz", f"-{compression_level}", file_path], check=True)
+    else:
+        with open(file_path, "rb") as f_in, gzip.open(
+            f"{file_path}.gz", "wb", compression_level
+        ) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        os.remove(file_path)
+
+    return f"{file_path}.gz"
+
+
+def mask_is_empty(mask_path):
+    """Check if the mask stored at mask_path has no voxels set. The maximum is computed by
+    SimpleITK, so no copy of the mask is made as a NumPy array.
+
+    Args:
+        mask_path (str|pathlib.Path): The mask file to check
+
+    Returns:
+        bool: True if no voxels are set in the mask
+    """
+
+    min_max_filter = sitk.MinimumMaximumImageFilter()
+    min_max_filter.Execute(sitk.ReadImage(str(mask_path)))
+
+    return min_max_filter.GetMaximum() == 0
+
+
+def find_empty_masks(mask_paths, max_workers=None):
+    """Find which of the masks stored at mask_paths have no voxels set.
+
+    Empty masks written together (such as the per-structure outputs of one case) are byte for
+    byte identical, so masks are grouped by file size and, within a group, a mask matching one
+    already found to be empty is compared on disk instead of being decoded. Groups are checked
+    concurrently.
+
+    Args:
+        mask_paths (list): The mask files (pathlib.Path) to check
+        max_workers (int, optional): The number of groups checked at the same time. Defaults to
+            None, the ThreadPoolExecutor default.
+
+    Returns:
+        set: The paths in mask_paths of the empty masks
+    """
+
+    masks_by_size = {}
+    for mask_path in mask_paths:
+        masks_by_size.setdefault(mask_path.stat().st_size, []).append(mask_path)
+
+    def check_group(group):
+        empty_reference = None
+        empty = []
+        for mask_path in group:
+            if empty_reference is not None and filecmp.cmp(
+                empty_reference, mask_path, shallow=False
+            ):
+                empty.append(mask_path)
+            elif mask_is_empty(mask_path):
+                empty_reference = mask_path
+                empty.append(mask_path)
+        return empty
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return {
+            mask_path
+            for empty in executor.map(check_group, masks_by_size.values())
+            for mask_path in empty
+        }
@@ -119,10 +119,10 @@ def contour_comparison(
         else:
             # the user has specified a structure
             # first, check the structure isn't empty!
-            if sitk.GetArrayFromImage(contour_dict_a[structure_for_com]).sum() != 0:
+            if sitk.GetArrayViewFromImage(contour_dict_a[structure_for_com]).any():
                 cut = get_com(contour_dict_a[structure_for_com])
             # if it is, try the same structure in contour_set_b
-            elif sitk.GetArrayFromImage(contour_dict_b[structure_for_com]).sum() != 0:
+            elif sitk.GetArrayViewFromImage(contour_dict_b[structure_for_com]).any():
                 cut = get_com(contour_dict_b[structure_for_com])
 
         img_vis_kw["cut"] = cut
@@ -15,6 +15,8 @@
 
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 # import pydicom
 
 import SimpleITK as sitk
@@ -24,39 +26,139 @@ logger = logging.getLogger(__name__)
 # Need include celery here to be able to from Docker container
 # pylint: disable=unused-import
 from platipy.backend import app, DataObject, celery
+from platipy.backend.cache import (
+    add_to_cache,
+    cache_path,
+    read_series,
+    series_cache_key,
+    use_cached,
+)
 
+from platipy.imaging.projects.bronchus.bronchus import generate_lung_mask
+from platipy.imaging.utils.io import compress_file
 from platipy.imaging.projects.bronchus.run import (
     run_bronchus_segmentation,
     BRONCHUS_SETTINGS_DEFAULTS,
 )
 
+# caseWorkers sets the number of cases segmented at the same time. Each segmentation already uses
+# every core and holds several copies of the image, so cases are segmented one at a time unless
+# configured otherwise.
+BRONCHUS_SERVICE_SETTINGS_DEFAULTS = {**BRONCHUS_SETTINGS_DEFAULTS, "caseWorkers": 1}
 
-@app.register("Bronchus Segmentation", default_settings=BRONCHUS_SETTINGS_DEFAULTS)
-def bronchus_service(data_objects, working_dir, settings):
+# Masks are written uncompressed and gzipped in the background while the next cases run. The
+# service waits for a case's masks to be compressed before returning them.
+_compress_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gzip")
+
+
+def read_image(data_type, data_path):
     """
-    Implements the platipy framework to provide bronchus segmentation.
+    Read the image at data_path. DICOM series are read from the conversion cache if they have
+    been converted before, otherwise the series is read and added to the cache.
+
+    Returns the image and its cache key, which is None if the image isn't cached.
     """
 
-    logger.info("Running Bronchus Segmentation")
+    if data_type != "DICOM":
+        return sitk.ReadImage(data_path), None
 
-    output_objects = []
-    for data_object in data_objects:
-        logger.info("Running on data object: %s", data_object.path)
+    cache_key = series_cache_key(data_path)
+    if cache_key is None:
+        return read_series(data_path), None
+
+    converted_path = cache_path(cache_key)
+    if use_cached(converted_path):
+        return sitk.ReadImage(str(converted_path)), cache_key
 
-        # Read the image series
-        load_path = data_object.path
-        if data_object.type == "DICOM":
-            load_path = sitk.ImageSeriesReader().GetGDCMSeriesFileNames(data_object.path)
+    img = read_series(data_path)
+    add_to_cache(img, converted_path)
 
-        img = sitk.ReadImage(load_path)
-        results = run_bronchus_segmentation(img, settings)
+    return img, cache_key
 
-        # Save resulting masks and add to output for service
-        for output in results.keys():
 
-            mask_file = os.path.join(working_dir, "{0}.nii.gz".format(output))
-            sitk.WriteImage(results[output], mask_file)
+def cached_lung_mask(img, cache_key):
+    """
+    Generate the lung mask of img, which is kept in the cache under cache_key (from
+    series_cache_key) so that running the same image again, for example with different airway
+    settings, doesn't generate it again. If cache_key is None the mask isn't cached.
+    """
+
+    if cache_key is None:
+        return generate_lung_mask(img)
+
+    lung_mask_path = cache_path(cache_key, kind="lung")
+    if use_cached(lung_mask_path):
+        return sitk.ReadImage(str(lung_mask_path))
+
+    lung_mask = generate_lung_mask(img)
+    if lung_mask is not None:
+        add_to_cache(lung_mask, lung_mask_path)
+
+    return lung_mask
+
+
+def segment_case(data_type, data_path, case_path, settings):
+    """
+    Run the bronchus segmentation on the image at data_path, writing the resulting masks to
+    case_path.
 
+    Returns futures resolving to the paths of the masks once they have been compressed.
+    """
+
+    logger.info("Running on data object: %s", data_path)
+
+    # Read the image series
+    img, cache_key = read_image(data_type, data_path)
+    lung_mask = cached_lung_mask(img, cache_key)
+    results = run_bronchus_segmentation(img, settings, lung_mask=lung_mask)
+
+    os.makedirs(case_path)
+
+    mask_files = []
+    for output in results.keys():
+
+        # Written uncompressed and compressed in the background, so the case doesn't wait on it
+        mask_file = os.path.join(case_path, "{0}.nii".format(output))
+        sitk.WriteImage(results[output], mask_file, useCompression=False)
+        mask_files.append(_compress_pool.submit(compress_file, mask_file))
+
+    return mask_files
+
+
+@app.register("Bronchus Segmentation", default_settings=BRONCHUS_SERVICE_SETTINGS_DEFAULTS)
+def bronchus_service(data_objects, working_dir, settings):
+    """
+    Implements the platipy framework to provide bronchus segmentation.
+
+    Cases can be segmented concurrently (see the caseWorkers setting), each writing its masks to
+    its own directory.
+    """
+
+    logger.info("Running Bronchus Segmentation")
+
+    # Settings from clients written before caseWorkers was added don't include it
+    case_workers = settings.get("caseWorkers", 1)
+
+    with ThreadPoolExecutor(max_workers=case_workers) as executor:
+        case_futures = [
+            (
+                data_object,
+                executor.submit(
+                    segment_case,
+                    data_object.type,
+                    data_object.path,
+                    os.path.join(working_dir, str(case_idx)),
+                    settings,
+                ),
+            )
+            for case_idx, data_object in enumerate(data_objects)
+        ]
+
+    # Add resulting masks to output for service
+    output_objects = []
+    for data_object, case_future in case_futures:
+        for compress_future in case_future.result():
+            mask_file = compress_future.result()
             output_data_object = DataObject(type="FILE", path=mask_file, parent=data_object)
             output_objects.append(output_data_object)
 
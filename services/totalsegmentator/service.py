@@ -12,16 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import filecmp
 import os
+import shutil
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import logging
 import SimpleITK as sitk
 
-from totalsegmentator.python_api import totalsegmentator
-
+# This service's image installs platipy from PyPI, so only the released platipy.backend is
+# available here and the helpers below are kept in this file
 from platipy.backend import app, DataObject, celery  # pylint: disable=unused-import
 
 logger = logging.getLogger(__name__)
@@ -30,13 +33,168 @@ TOTALSEG_SETTINGS_DEFAULTS = {
     "output_prefix": "TS_",
     "fast": False,
     "body_seg": False,
+    "roi_subset": None,
 }
 
+NIFTI_SUFFIXES = (".nii.gz", ".nii")
+
+# Number of TotalSegmentator output masks read at the same time
+MASK_CHECK_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def link_input(source_path, input_path):
+    """
+    Link a NIfTI input file into the input directory for TotalSegmentator. A hard link is used
+    where possible, falling back to a symbolic link across file systems and to a copy if no link
+    can be created. This avoids decoding and re-encoding an image that is already NIfTI.
+
+    Returns the path of the file in the input directory.
+    """
+
+    source_path = Path(source_path)
+    suffix = ".nii.gz" if source_path.name.endswith(".nii.gz") else ".nii"
+    io_path = input_path.joinpath(f"image_0000{suffix}")
+
+    # Same as platipy.imaging.utils.io.link_file, which isn't in the released platipy yet
+    try:
+        os.link(source_path, io_path)
+    except OSError:
+        try:
+            os.symlink(source_path.resolve(), io_path)
+        except OSError:
+            shutil.copyfile(source_path, io_path)
+
+    return io_path
+
+
+def read_series(series_path):
+    """
+    Read the DICOM series in the directory series_path, splitting the work across all cores.
+    """
+
+    reader = sitk.ImageSeriesReader()
+    reader.SetFileNames(reader.GetGDCMSeriesFileNames(str(series_path)))
+    reader.SetNumberOfWorkUnits(os.cpu_count() or 1)
+    return reader.Execute()
+
+
+def convert_to_nifti(data_type, data_path, input_path):
+    """
+    Convert the image at data_path to uncompressed NIfTI in input_path for TotalSegmentator.
+
+    Returns the path of the converted image.
+    """
+
+    if data_type == "DICOM":
+        img = read_series(data_path)
+    else:
+        img = sitk.ReadImage(data_path)
+
+    io_path = input_path.joinpath("image_0000.nii")
+    sitk.WriteImage(img, str(io_path), useCompression=False)
+
+    return io_path
+
+
+def stage_input(data_type, data_path, input_path):
+    """
+    Stage the image at data_path in input_path for TotalSegmentator.
+
+    Returns the path of the staged image.
+    """
+
+    input_path.mkdir()
+
+    if data_type != "DICOM" and data_path.endswith(NIFTI_SUFFIXES):
+        # Already NIfTI, so TotalSegmentator can use the file as is
+        return link_input(data_path, input_path)
+
+    # Converted to uncompressed NIfTI, TotalSegmentator reads it straight back in so compressing
+    # it only costs time
+    return convert_to_nifti(data_type, data_path, input_path)
+
+
+def mask_is_empty(mask_path):
+    """
+    Check if the mask stored at mask_path has no voxels set, without a NumPy copy of the mask.
+    """
+
+    min_max_filter = sitk.MinimumMaximumImageFilter()
+    min_max_filter.Execute(sitk.ReadImage(str(mask_path)))
+
+    return min_max_filter.GetMaximum() == 0
+
+
+def find_empty_masks(mask_paths):
+    """
+    Find which of the masks stored at mask_paths have no voxels set. Same as
+    platipy.imaging.utils.io.find_empty_masks, which isn't in the released platipy yet.
+
+    Empty masks of one case are byte for byte identical, so masks are grouped by file size and
+    a mask matching one already found to be empty in its group is compared on disk instead of
+    being decoded. Groups are checked concurrently.
+
+    Returns the set of paths of the empty masks.
+    """
+
+    masks_by_size = {}
+    for mask_path in mask_paths:
+        masks_by_size.setdefault(mask_path.stat().st_size, []).append(mask_path)
+
+    def check_group(group):
+        empty_reference = None
+        empty = []
+        for mask_path in group:
+            if empty_reference is not None and filecmp.cmp(
+                empty_reference, mask_path, shallow=False
+            ):
+                empty.append(mask_path)
+            elif mask_is_empty(mask_path):
+                empty_reference = mask_path
+                empty.append(mask_path)
+        return empty
+
+    with ThreadPoolExecutor(max_workers=MASK_CHECK_WORKERS) as executor:
+        return {
+            mask_path
+            for empty in executor.map(check_group, masks_by_size.values())
+            for mask_path in empty
+        }
+
+
+def collect_masks(output_path, output_prefix):
+    """
+    Collect the masks TotalSegmentator wrote to output_path, skipping any which are empty and
+    renaming the rest with output_prefix.
+
+    Returns the paths of the renamed masks.
+    """
+
+    mask_paths = sorted(output_path.glob("*.nii.gz"))
+    empty_masks = find_empty_masks(mask_paths)
+
+    collected = []
+    for op in mask_paths:
+        if op in empty_masks:
+            logger.info("Skipping empty segmentation: %s", op.name)
+            continue
+
+        # Rename the file with the prefix
+        new_name = f"{output_prefix}{op.name}"
+        op = op.rename(op.parent.joinpath(new_name))
+        logger.info("Found segmentation file: %s", op.name)
+        collected.append(op)
+
+    return collected
+
 
 @app.register("TotalSegmentator Service", default_settings=TOTALSEG_SETTINGS_DEFAULTS)
 def totalsegmentator_service(data_objects, working_dir, settings):
     """
     Run the TotalSegmentator
+
+    The next case is staged and the masks of the previous case are collected in background
+    threads while TotalSegmentator runs on the current case.
     """
 
     output_objects = []
@@ -51,51 +209,81 @@ def totalsegmentator_service(data_objects, working_dir, settings):
     output_path = Path(working_dir).joinpath("output")
     output_path.mkdir()
 
-    for data_object in data_objects:
-        # Create a symbolic link for each image to auto-segment using the nnUNet
-        io_path = input_path.joinpath("image_0000.nii.gz")
-        load_path = data_object.path
-        if data_object.type == "DICOM":
-            load_path = sitk.ImageSeriesReader().GetGDCMSeriesFileNames(load_path)
-
-        img = sitk.ReadImage(load_path)
-        sitk.WriteImage(img, str(io_path))
-
-        logger.info("Running TotalSegmentator on input path: %s", str(io_path))
-
-        command = [
-            "TotalSegmentator",
-            "-i",
-            str(io_path),
-            "-o",
-            str(output_path),
-        ]
-
-        if settings["fast"]:
-            command += ["--fast"]
-
-        if settings["body_seg"]:
-            command += ["--body_seg"]
-
-        logger.info("Running command: %s", command)
-        subprocess.call(command)
-
-        for op in output_path.glob("*.nii.gz"):
-            # Check its not empty
-            mask = sitk.ReadImage(str(op))
-            if sitk.GetArrayFromImage(mask).sum() == 0:
-                logger.info("Skipping empty segmentation: %s", op.name)
-                continue
-
-            # Rename the file with the prefix
-            new_name = f"{settings['output_prefix']}{op.name}"
-            op = op.rename(op.parent.joinpath(new_name))
+    # Each case gets its own input and output directory so the stages don't see each other's
+    # files. Paths and types are read here, the database objects stay on this thread.
+    cases = [
+        (data_object, data_object.type, data_object.path, str(case_idx))
+        for case_idx, data_object in enumerate(data_objects)
+    ]
+
+    collect_futures = []
+    with ThreadPoolExecutor(max_workers=1) as stage_executor, ThreadPoolExecutor(
+        max_workers=1
+    ) as collect_executor:
+
+        def stage_case(case):
+            _, data_type, data_path, case_dir = case
+            return stage_executor.submit(
+                stage_input, data_type, data_path, input_path.joinpath(case_dir)
+            )
+
+        stage_future = stage_case(cases[0]) if cases else None
+        for case_idx, (data_object, _, _, case_dir) in enumerate(cases):
+            io_path = stage_future.result()
+
+            # Stage the next case while this one is segmented
+            if case_idx + 1 < len(cases):
+                stage_future = stage_case(cases[case_idx + 1])
+
+            case_output_path = output_path.joinpath(case_dir)
+            case_output_path.mkdir()
+
+            logger.info("Running TotalSegmentator on input path: %s", str(io_path))
+
+            command = [
+                "TotalSegmentator",
+                "-i",
+                str(io_path),
+                "-o",
+                str(case_output_path),
+            ]
+
+            if settings["fast"]:
+                command += ["--fast"]
+
+            if settings["body_seg"]:
+                command += ["--body_seg"]
+
+            # Settings from clients written before roi_subset was added don't include it
+            if settings.get("roi_subset"):
+                command += ["--roi_subset"] + list(settings["roi_subset"])
+
+            # TotalSegmentator runs in its own process, Celery worker processes are daemonic so
+            # its multiprocessing can't run inside them. The staging and collecting threads keep
+            # working while this thread waits on it.
+            logger.info("Running command: %s", command)
+            process = subprocess.Popen(command)
+            return_code = process.wait()
+            if return_code != 0:
+                logger.error("TotalSegmentator exited with code %s", return_code)
+
+            # The case's input is no longer needed, remove its whole directory
+            shutil.rmtree(io_path.parent)
+
+            collect_futures.append(
+                (
+                    data_object,
+                    collect_executor.submit(
+                        collect_masks, case_output_path, settings["output_prefix"]
+                    ),
+                )
+            )
+
+    for data_object, collect_future in collect_futures:
+        for op in collect_future.result():
             output_data_object = DataObject(type="FILE", path=str(op), parent=data_object)
-            logger.info("Found segmentation file: %s", op.name)
             output_objects.append(output_data_object)
 
-        os.remove(io_path)
-
     logger.info("Finished running TotalSegmentator")
 
     return output_objects